@@ -0,0 +1,98 @@
+import os
+import re
+import logging
+import pandas as pd
+
+logger = logging.getLogger("formatki.catalog")
+
+
+def parse_shards(spec):
+    shards = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        path, _, sheet = part.partition("#")
+        shards.append((path.strip(), sheet.strip() or 0))
+    return shards
+
+
+def _norm_cell(v):
+    if isinstance(v, str):
+        s = v.strip()
+        if (s.startswith("'") and s.endswith("'")) or (s.startswith('"') and s.endswith('"')):
+            s = s[1:-1].strip()
+        return s
+    return v
+
+
+def _norm_header(c):
+    s = " ".join(str(c).split())
+    m = re.match(r'^punktor\s*(\d+)$', s, re.IGNORECASE)
+    if m:
+        return f"Punktor {int(m.group(1))}"
+    return s
+
+
+def detect_columns(df):
+    cols = {c.strip().lower(): c for c in df.columns}
+    if 'gt' in cols and 'kw' in cols and 'pion' in cols:
+        return cols['gt'], cols['kw'], cols['pion']
+    col0 = df.columns[0]
+    col1 = df.columns[1] if len(df.columns) > 1 else df.columns[0]
+    col2 = df.columns[2] if len(df.columns) > 2 else df.columns[0]
+    return col0, col1, col2
+
+
+def _dedupe_headers(names, keep=()):
+    # Nazwy porównujemy bez wielkości liter - tak samo jak przy scalaniu shardów.
+    out = list(names)
+    seen = {out[i].lower() for i in keep}
+    for i, name in enumerate(names):
+        if i in keep:
+            continue
+        new, n = name, 1
+        while new.lower() in seen:
+            new = f"{name}.{n}"
+            n += 1
+        if new != name:
+            logger.warning("Duplicate column %r renamed to %r", name, new)
+        seen.add(new.lower())
+        out[i] = new
+    return out
+
+
+# Uruchamiane w procesach roboczych - moduł nie może importować main.
+def load_shard(path, sheet):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Plik nie znaleziony: {path}")
+    df = pd.read_excel(path, sheet_name=sheet, header=0, dtype=str)
+    df = df.fillna("")
+    df = df.map(_norm_cell)
+    # Układ kolumn różni się między zespołami - nagłówki ujednolicamy przed scaleniem.
+    df.columns = _dedupe_headers([_norm_header(c) for c in df.columns])
+    detected = detect_columns(df)
+    canonical = dict(zip(detected, ("GT", "KW", "PION")))
+    keep = [i for i, c in enumerate(df.columns) if c in canonical]
+    df.columns = _dedupe_headers([canonical.get(c, c) for c in df.columns], keep=keep)
+    punktor_cols = [c for c in df.columns if c.lower().startswith("punktor")]
+    if not punktor_cols:
+        # Bez nagłówków "Punktor" atrybutami są kolumny 10..29 - pozycja ma sens tylko w obrębie shardu.
+        punktor_cols = [c for c in df.columns[10:30] if c not in ("GT", "KW", "PION")]
+    return df, punktor_cols
+
+
+def merge_shards(shards):
+    # Ta sama kolumna różniąca się wielkością liter dostaje nazwę z pierwszego shardu.
+    names = {}
+    frames = []
+    punktor_cols = []
+    for df, cols in shards:
+        mapping = {c: names.setdefault(c.lower(), c) for c in df.columns}
+        frames.append(df.rename(columns=mapping))
+        for c in cols:
+            if mapping[c] not in punktor_cols:
+                punktor_cols.append(mapping[c])
+    merged = pd.concat(frames, ignore_index=True).fillna("")
+    merged.attrs["punktor_cols"] = punktor_cols
+    return merged
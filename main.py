@@ -1,9 +1,17 @@
 import os
 import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
 import traceback
 import unicodedata
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template, send_file
+from concurrent.futures import ProcessPoolExecutor
+from logging.handlers import RotatingFileHandler
+from flask import Flask, request, jsonify, render_template, send_file, g, has_request_context
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import pandas as pd
@@ -12,10 +20,15 @@ from openpyxl.styles import PatternFill, Font, Alignment
 from email.message import EmailMessage
 import smtplib
 from email_validator import validate_email, EmailNotValidError
+from catalog import parse_shards, load_shard, merge_shards, detect_columns
 
 load_dotenv()
 
 BASE_XLSX = os.getenv("BASE_XLSX", "baza.xlsx")
+# Lista źródeł katalogu "plik.xlsx#Arkusz" oddzielona przecinkami (bez "#" - pierwszy arkusz).
+CATALOG_SHARDS = os.getenv("CATALOG_SHARDS", f"{BASE_XLSX}#Arkusz1")
+CATALOG_WORKERS = int(os.getenv("CATALOG_WORKERS", 0))
+CATALOG_PRELOAD = os.getenv("CATALOG_PRELOAD", "1") != "0"
 SMTP_HOST = os.getenv("SMTP_HOST")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587)) if os.getenv("SMTP_PORT") else 587
 SMTP_USER = os.getenv("SMTP_USER")
@@ -23,6 +36,9 @@ SMTP_PASS = os.getenv("SMTP_PASS")
 EMAIL_FROM = os.getenv("EMAIL_FROM", SMTP_USER)
 EMAIL_FROM_NAME = os.getenv("EMAIL_FROM_NAME", "Formatki OBI")
 LOGO_URL = os.getenv("LOGO_URL", "")
+RECORD_LOG = os.getenv("RECORD_LOG", "")
+RECORD_LOG_MAX_BYTES = int(os.getenv("RECORD_LOG_MAX_BYTES", 10 * 1024 * 1024))
+RECORD_LOG_BACKUPS = int(os.getenv("RECORD_LOG_BACKUPS", 3))
 INSTRUCTION_URL = "https://drive.google.com/file/d/1s4qkGRXTBxtpq6RpRUQdnqUumDyZhurp/view?usp=drive_link"
 
 TMP_DIR = os.path.join(os.getcwd(), "tmp")
@@ -33,33 +49,87 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 
 ALLOWED_DOMAIN = "obi.pl"
 
+# Pola payloadu, których nie zapisujemy w logu nagrań (dane osobowe).
+RECORD_SKIP_FIELDS = ("emails", "email")
+# Nagłówek z numerem wpisu ustawiany przez replay.py, kopiowany do nagrania.
+RECORD_SEQ_HEADER = "X-Replay-Seq"
 
-def _load_df():
-    if not os.path.exists(BASE_XLSX):
-        raise FileNotFoundError(f"Plik nie znaleziony: {BASE_XLSX}")
-    df = pd.read_excel(BASE_XLSX, sheet_name="Arkusz1", header=0, dtype=str)
-    df = df.fillna("")
+_record_logger = None
+if RECORD_LOG:
+    _record_logger = logging.getLogger("formatki.record")
+    _record_logger.setLevel(logging.INFO)
+    _record_logger.propagate = False
+    _record_handler = RotatingFileHandler(RECORD_LOG, maxBytes=RECORD_LOG_MAX_BYTES,
+                                          backupCount=RECORD_LOG_BACKUPS, encoding="utf-8")
+    _record_handler.setFormatter(logging.Formatter("%(message)s"))
+    _record_logger.addHandler(_record_handler)
 
-    def _norm(v):
-        if isinstance(v, str):
-            s = v.strip()
-            if (s.startswith("'") and s.endswith("'")) or (s.startswith('"') and s.endswith('"')):
-                s = s[1:-1].strip()
-            return s
-        return v
 
-    df = df.map(_norm)
-    return df
+SHARDS = parse_shards(CATALOG_SHARDS)
 
 
-def _detect_columns(df):
-    cols = {c.strip().lower(): c for c in df.columns}
-    if 'gt' in cols and 'kw' in cols and 'pion' in cols:
-        return cols['gt'], cols['kw'], cols['pion']
-    col0 = df.columns[0]
-    col1 = df.columns[1] if len(df.columns) > 1 else df.columns[0]
-    col2 = df.columns[2] if len(df.columns) > 2 else df.columns[0]
-    return col0, col1, col2
+def _shard_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+_catalog_lock = threading.Lock()
+_catalog_shards = {}
+_catalog_df = None
+
+
+def _load_df(pool=None):
+    global _catalog_df
+    with _catalog_lock:
+        stale = [sh for sh in SHARDS
+                 if sh not in _catalog_shards or _catalog_shards[sh][0] != _shard_mtime(sh[0])]
+        if stale:
+            mtimes = {sh: _shard_mtime(sh[0]) for sh in stale}
+            # Wersja katalogu z zawartości pliku - mtime zmienia się przy checkout/kopiowaniu.
+            digests = {sh: _file_digest(sh[0]) if mtimes[sh] is not None else "" for sh in stale}
+            if pool is not None and len(stale) > 1:
+                loaded = list(pool.map(load_shard, *zip(*stale)))
+            else:
+                loaded = [load_shard(*sh) for sh in stale]
+            # Cache podmieniamy dopiero po udanym scaleniu - inaczej błąd zostawiłby nowe mtime bez danych.
+            shards = dict(_catalog_shards)
+            for sh, (frame, punktor_cols) in zip(stale, loaded):
+                shards[sh] = (mtimes[sh], digests[sh], frame, punktor_cols)
+            merged = merge_shards([shards[sh][2:] for sh in SHARDS])
+            for sh in stale:
+                app.logger.info("Loaded catalog shard %s#%s rows=%d", sh[0], sh[1], len(shards[sh][2]))
+            _catalog_shards.clear()
+            _catalog_shards.update(shards)
+            _catalog_df = merged
+        return _catalog_df
+
+
+def _preload_catalog():
+    # Pula procesów tylko przy starcie - przeładowanie zmienionego shardu idzie w procesie.
+    if len(SHARDS) < 2:
+        return _load_df()
+    workers = min(len(SHARDS), CATALOG_WORKERS or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return _load_df(pool)
+
+
+def _catalog_version():
+    return ",".join(_catalog_shards[sh][1] if sh in _catalog_shards else "" for sh in SHARDS)
+
+
+def _record_stage(name, started):
+    if has_request_context() and "rec_stages" in g:
+        g.rec_stages[name] = round((time.perf_counter() - started) * 1000, 2)
 
 
 def _safe_sheet_name(name, existing_names=None):
@@ -275,9 +345,11 @@ def _write_excel_and_format(pion, gt_list, kw_list, df, desired_base, desired_at
     tmp_path = os.path.join(TMP_DIR, secure_filename(filename))
     found_any = False
     used_sheet_names = set()
-    gt_col, kw_col, pion_col = _detect_columns(df)
+    gt_col, kw_col, pion_col = detect_columns(df)
     app.logger.info("Detected columns: GT=%s, KW=%s, PION=%s", gt_col, kw_col, pion_col)
-    punktor_cols = [c for c in df.columns if str(c).strip().lower().startswith("punktor")]
+    punktor_cols = [c for c in df.attrs.get("punktor_cols", []) if c not in desired_base]
+    if not punktor_cols:
+        punktor_cols = [c for c in df.columns if str(c).strip().lower().startswith("punktor")]
     if not punktor_cols:
         candidate_idxs = list(range(10, min(len(df.columns), 30)))
         punktor_cols = [df.columns[i] for i in candidate_idxs if i < len(df.columns)]
@@ -325,6 +397,7 @@ def _write_excel_and_format(pion, gt_list, kw_list, df, desired_base, desired_at
         else:
             for gt in gt_list:
                 selected_map.setdefault(gt, []).append(str(item))
+    t0 = time.perf_counter()
     with pd.ExcelWriter(tmp_path, engine="xlsxwriter") as writer:
         for gt, kws in selected_map.items():
             for kw in kws:
@@ -403,18 +476,23 @@ def _write_excel_and_format(pion, gt_list, kw_list, df, desired_base, desired_at
             else:
                 processed.append(line)
         pd.DataFrame(processed).to_excel(writer, sheet_name="Wymagania", index=False, header=False)
+    _record_stage("write", t0)
     app.logger.info("_write_excel_and_format finished; found_any=%s tmp_path=%s", found_any, tmp_path)
+    t0 = time.perf_counter()
     try:
         _style_workbook(tmp_path)
     except Exception:
         app.logger.exception("Error styling workbook %s", tmp_path)
+    _record_stage("style", t0)
     return tmp_path, found_any
 
 
 def _create_excel_for_selection(pion, gt_list, kw_list):
     timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
     filename = f"{secure_filename(pion)}.xlsx"
+    t0 = time.perf_counter()
     df = _load_df()
+    _record_stage("load", t0)
     desired_base = [
         "EAN",
         "Nr. Art dostawcy",
@@ -432,6 +510,8 @@ def _create_excel_for_selection(pion, gt_list, kw_list):
         "Gwarancja: {jeśli powyżej 2 lat}"
     ]
     tmp_path, found_any = _write_excel_and_format(pion, gt_list, kw_list, df, desired_base, desired_attributes, filename)
+    if has_request_context() and "rec_stages" in g and os.path.exists(tmp_path):
+        g.rec_output_bytes = os.path.getsize(tmp_path)
     return tmp_path, filename, found_any
 
 
@@ -464,6 +544,43 @@ def _send_email_with_attachment(to_emails, subject, html_body, attachment_path):
         s.send_message(msg)
     return True
 
+@app.before_request
+def _record_start():
+    if _record_logger is None or not request.path.startswith(("/api/", "/_debug_rows")):
+        return
+    g.rec_started = time.perf_counter()
+    g.rec_stages = {}
+
+
+@app.after_request
+def _record_finish(response):
+    if "rec_started" not in g:
+        return response
+    try:
+        total_ms = round((time.perf_counter() - g.rec_started) * 1000, 2)
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload = {k: v for k, v in payload.items() if k not in RECORD_SKIP_FIELDS}
+        rec = {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "endpoint": request.path,
+            "method": request.method,
+            "args": request.args.to_dict(),
+            "payload": payload,
+            "catalog_version": _catalog_version(),
+            "status": response.status_code,
+            "total_ms": total_ms,
+            "stages": g.rec_stages,
+            "output_bytes": g.get("rec_output_bytes", response.content_length),
+        }
+        seq = request.headers.get(RECORD_SEQ_HEADER)
+        if seq is not None:
+            rec["seq"] = seq
+        _record_logger.info(json.dumps(rec, ensure_ascii=False))
+    except Exception:
+        app.logger.exception("request recording failed for %s", request.path)
+    return response
+
 @app.route("/")
 @app.route("/index")
 def index2():
@@ -473,7 +590,7 @@ def index2():
 def api_get_data_structure():
     try:
         df = _load_df()
-        gt_col, kw_col, pion_col = _detect_columns(df)
+        gt_col, kw_col, pion_col = detect_columns(df)
         structure = {}
         for _, row in df.iterrows():
             gt = str(row[gt_col]).strip()
@@ -494,7 +611,7 @@ def api_get_gt():
     pion = request.args.get("pion", "")
     try:
         df = _load_df()
-        gt_col, _, pion_col = _detect_columns(df)
+        gt_col, _, pion_col = detect_columns(df)
         sel = df[df[pion_col].astype(str).str.strip().str.lower() == str(pion).strip().lower()]
         gts = sorted(sel[gt_col].astype(str).str.strip().unique())
         return jsonify(list(gts))
@@ -508,7 +625,7 @@ def api_get_kw_for_gt_list():
     gt_list = data.get("gtList", []) or []
     try:
         df = _load_df()
-        gt_col, kw_col, pion_col = _detect_columns(df)
+        gt_col, kw_col, pion_col = detect_columns(df)
         out = []
         seen = set()
         for gt in gt_list:
@@ -537,7 +654,7 @@ def api_resolve_gt_codes():
         codes = [s.strip() for s in raw.split(",") if s.strip()]
     try:
         df = _load_df()
-        gt_col, kw_col, pion_col = _detect_columns(df)
+        gt_col, kw_col, pion_col = detect_columns(df)
         dfp = df[df[pion_col].astype(str).str.strip().str.lower() == str(pion).strip().lower()]
         full = set()
         for code in codes:
@@ -557,7 +674,7 @@ def _debug_rows():
     kw = data.get("kw", "")
     try:
         df = _load_df()
-        gt_col, kw_col, pion_col = _detect_columns(df)
+        gt_col, kw_col, pion_col = detect_columns(df)
         sel = df[
             (df[pion_col].astype(str).str.strip().str.lower() == str(pion).strip().lower())
             & (df[gt_col].astype(str).str.strip().str.lower() == str(gt).strip().lower())
@@ -640,5 +757,12 @@ def api_generate():
         app.logger.error("Exception in api_generate:\n%s", tb)
         return jsonify({"success": False, "error": str(e), "traceback": tb}), 500
 
+# Wstępne wczytanie katalogu przy starcie (nie w procesach roboczych puli).
+if CATALOG_PRELOAD and multiprocessing.parent_process() is None:
+    try:
+        _preload_catalog()
+    except Exception:
+        app.logger.exception("Catalog preload failed")
+
 if __name__ == "__main__":
     app.run(debug=False, host="0.0.0.0", port=int(os.getenv("PORT", 5000)))
@@ -0,0 +1,140 @@
+import os, io, sys, json, hashlib, argparse
+from openpyxl import load_workbook
+
+# Odtwarza log nagrań (RECORD_LOG) na aplikacji przez test client Flaska i porównuje
+# czasy etapów oraz hashe skoroszytów z baseline (domyślnie: sam log wejściowy).
+#   python replay.py requests.jsonl --out replay.jsonl
+#   python replay.py requests.jsonl --baseline replay-poprzedni.jsonl --tolerance 0.25
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def read_jsonl(fn):
+    out = []
+    with open(fn, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                out.append(json.loads(line))
+    return out
+
+
+def replayable(entries):
+    # Odrzucone wywołania (4xx/5xx) nie są częścią korpusu - np. /api/generate bez poprawnych adresów.
+    return [e for e in entries if (e.get("status") or 200) < 400]
+
+
+def workbook_digest(data):
+    # Hash po nazwach arkuszy i wartościach komórek - surowe bajty xlsx zawierają znaczniki czasu.
+    h = hashlib.sha256()
+    wb = load_workbook(io.BytesIO(data), read_only=True)
+    try:
+        for name in wb.sheetnames:
+            h.update(f"#{name}\n".encode("utf-8"))
+            for row in wb[name].iter_rows(values_only=True):
+                h.update(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"))
+                h.update(b"\n")
+    finally:
+        wb.close()
+    return h.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("log")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--out", default="replay.jsonl")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="dopuszczalny wzrost czasu (0.2 = +20%%)")
+    parser.add_argument("--min-ms", type=float, default=50.0, help="ignoruj różnice czasu poniżej tylu ms")
+    parser.add_argument("--warmup", type=int, default=0, help="ile pierwszych wpisów pominąć w porównaniu czasów")
+    opts = parser.parse_args()
+
+    out_path = os.path.realpath(opts.out)
+    for src in (opts.log, opts.baseline):
+        if src and os.path.realpath(src) == out_path:
+            parser.error(f"--out nie może wskazywać pliku wejściowego: {src}")
+
+    entries = replayable(read_jsonl(opts.log))
+    # Wpisy łączymy po numerze "seq"; log bez numerów (z produkcji) numerujemy po kolei po filtrze.
+    baseline = replayable(read_jsonl(opts.baseline)) if opts.baseline else entries
+    baseline = {str(b.get("seq", i)): b for i, b in enumerate(baseline)}
+
+    # Aplikacja sama zapisuje wyniki odtworzenia przez swój middleware nagrywania.
+    if os.path.exists(opts.out):
+        os.remove(opts.out)
+    os.environ["RECORD_LOG"] = opts.out
+    os.environ["RECORD_LOG_MAX_BYTES"] = "0"
+    # Katalog wczytujemy jawnie tutaj, a nie przy imporcie main.
+    os.environ["CATALOG_PRELOAD"] = "0"
+    import main as formatki
+    formatki._preload_catalog()
+
+    client = formatki.app.test_client()
+    hashes = {}
+    remapped = set()
+    for i, e in enumerate(entries):
+        seq = str(i)
+        endpoint = e.get("endpoint", "")
+        # /api/generate wysyła maile - generujemy ten sam plik przez /api/generate_debug.
+        if endpoint == "/api/generate":
+            endpoint = "/api/generate_debug"
+            remapped.add(seq)
+        headers = {formatki.RECORD_SEQ_HEADER: seq}
+        if e.get("method") == "GET":
+            resp = client.get(endpoint, query_string=e.get("args") or {}, headers=headers)
+        else:
+            resp = client.post(endpoint, query_string=e.get("args") or {}, json=e.get("payload"), headers=headers)
+        if resp.mimetype == XLSX_MIMETYPE:
+            hashes[seq] = workbook_digest(resp.get_data())
+        resp.close()
+        print(f"[{i + 1}/{len(entries)}] {e.get('method')} {endpoint} -> {resp.status_code}")
+
+    # Hash liczymy tutaj, nie w middleware - wynik z hashami nadaje się na kolejny baseline.
+    results = read_jsonl(opts.out)
+    for res in results:
+        res["workbook_hash"] = hashes.get(res.get("seq"))
+    with open(opts.out, "w", encoding="utf-8") as f:
+        for res in results:
+            f.write(json.dumps(res, ensure_ascii=False) + "\n")
+    results = {res.get("seq"): res for res in results}
+
+    regressions = 0
+    mismatches = 0
+    for seq, base in baseline.items():
+        label = f"#{int(seq) + 1} {base.get('endpoint')}"
+        res = results.get(seq)
+        if res is None:
+            print(f"{label}: brak wyniku odtworzenia")
+            mismatches += 1
+            continue
+        if base.get("catalog_version") != res.get("catalog_version"):
+            print(f"{label}: inna wersja katalogu ({base.get('catalog_version')} -> {res.get('catalog_version')})")
+        if base.get("status") != res.get("status"):
+            print(f"{label}: status {base.get('status')} -> {res.get('status')}")
+            mismatches += 1
+        if base.get("workbook_hash") and base.get("workbook_hash") != res.get("workbook_hash"):
+            print(f"{label}: inny hash skoroszytu")
+            mismatches += 1
+        if int(seq) < opts.warmup:
+            continue
+        timings = []
+        # Czas całkowity nagranego /api/generate zawiera wysyłkę SMTP - porównujemy tylko etapy.
+        if seq not in remapped and base.get("endpoint") != "/api/generate":
+            timings.append(("total", base.get("total_ms"), res.get("total_ms")))
+        for stage, ms in (base.get("stages") or {}).items():
+            timings.append((stage, ms, (res.get("stages") or {}).get(stage)))
+        for stage, before, after in timings:
+            if before is None or after is None:
+                continue
+            if after - before > opts.min_ms and after > before * (1 + opts.tolerance):
+                print(f"{label}: {stage} {before:.1f} ms -> {after:.1f} ms")
+                regressions += 1
+
+    print()
+    print(f"Wpisy: {len(results)}, regresje czasu: {regressions}, różnice wyniku: {mismatches}")
+    print("Wyniki:", opts.out)
+    return 1 if regressions or mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())